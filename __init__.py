@@ -15,8 +15,6 @@ if libs_dir not in sys.path:
 from aqt import mw, gui_hooks
 from aqt.qt import QAction
 from aqt.utils import showInfo
-from .batch_handler import BatchTTSHandler
-from .config_dialog import ConfigDialog
 
 def get_config():
     """Helper to get config"""
@@ -38,6 +36,9 @@ def get_active_api_key(config):
 
 def on_open_settings():
     """Opened from Tools -> Gemini TTS Configuration"""
+    # Imported here so the UI modules aren't loaded during Anki startup
+    from .config_dialog import ConfigDialog
+    
     config = get_config()
     
     # Open the configuration dialog
@@ -63,10 +64,17 @@ def on_batch_tts(browser):
         showInfo("Please configure your API Key in 'Tools > Gemini TTS Configuration' first.", parent=browser)
         return
 
-    # 3. Start processing
+    # 3. Start processing (imported lazily; pulls in the TTS SDKs)
+    from .batch_handler import BatchTTSHandler
     handler = BatchTTSHandler(mw, selected)
     handler.start()
 
+def on_profile_will_close():
+    """Release shared API connections; nothing to do if no batch ever ran"""
+    tts_processor = sys.modules.get(f"{__name__}.tts_processor")
+    if tts_processor:
+        tts_processor.close_all_clients()
+
 def setup_browser_menu(browser):
     """Add menu entry to the Browser's 'Notes' menu"""
     action = QAction("Add Gemini TTS to Selected", browser)
@@ -87,4 +95,7 @@ def setup_main_menu():
 setup_main_menu()
 
 # 2. Setup Browser Menu (Batch Processing)
-gui_hooks.browser_menus_did_init.append(setup_browser_menu)
\ No newline at end of file
+gui_hooks.browser_menus_did_init.append(setup_browser_menu)
+
+# 3. Close shared API clients when the profile is unloaded
+gui_hooks.profile_will_close.append(on_profile_will_close)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+
+class AudioCache:
+    """Disk cache of generated audio, keyed by a hash of the text and voice settings.
+    Entries are evicted least-recently-used first once the cache grows past max_bytes.
+    Each entry also remembers the media filename its audio was saved under, so a hit
+    can point at that file without reading the audio back."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'cache_index.sqlite'), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, bytes_len INTEGER NOT NULL, "
+            "mtime REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, filename TEXT)"
+        )
+        # Indexes created before filenames were tracked
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        if 'filename' not in columns:
+            self._db.execute("ALTER TABLE entries ADD COLUMN filename TEXT")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hash the text and generation settings into a cache key"""
+        raw = '|'.join(str(p) for p in parts)
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached audio for key, or None on a miss"""
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                # File vanished behind our back; forget the entry
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+
+            self._db.execute("UPDATE entries SET mtime = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return data
+
+    def get_filename(self, key: str) -> Optional[str]:
+        """Return the media filename recorded for key, or None"""
+        with self._lock:
+            row = self._db.execute("SELECT filename FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row or not row[0]:
+                return None
+
+            self._db.execute("UPDATE entries SET mtime = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key: str, data: bytes, filename: Optional[str] = None):
+        """Store audio for key, evicting old entries if over budget"""
+        with self._lock:
+            path = self._path(key)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, bytes_len, mtime, hits, filename) VALUES (?, ?, ?, 0, ?)",
+                (key, len(data), time.time(), filename)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(bytes_len), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute("SELECT key, bytes_len FROM entries ORDER BY mtime ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,14 +1,130 @@
+import os
 import time
 import re
+import random
+import hashlib
 import threading
 import json
 import concurrent.futures
-from collections import defaultdict
+from collections import deque
 from typing import List, Dict, Optional
-from aqt.qt import QDialog, QVBoxLayout, QProgressBar, QLabel, QPushButton, QTextEdit, QThread, pyqtSignal, Qt, QFont
+from aqt.qt import QDialog, QVBoxLayout, QProgressBar, QLabel, QPushButton, QPlainTextEdit, QThread, QTimer, pyqtSignal, Qt, QFont
 from aqt import mw
+from anki.utils import ids2str
 from .config_dialog import ConfigDialog
 from .tts_processor import TTSProcessor
+from .audio_cache import AudioCache
+
+# Notes are read and saved in slices so each main-thread hop covers many notes
+NOTE_BATCH_SIZE = 32
+
+# Seconds a finished result may wait for its save batch to fill up
+SAVE_MAX_DELAY = 1.0
+
+# Lines kept in the progress log; older lines are dropped
+LOG_MAX_LINES = 2000
+
+# Bounds in seconds for the request spacing while backing off from rate limits
+PACER_MIN_BACKOFF = 0.5
+PACER_MAX_INTERVAL = 30.0
+
+# Seconds during which further rate-limit reports count as the same burst
+# (they come from every worker and from each retry of the first failures)
+PACER_BURST_WINDOW = 10.0
+
+# Successful requests in a row after which each further success undoes one backoff step
+PACER_RECOVER_AFTER = 3
+
+# Consecutive quota-exhausted failures after which the batch is stopped
+QUOTA_ABORT_AFTER = 3
+
+# Minimum seconds between progress updates sent to the dialog
+PROGRESS_INTERVAL = 0.1
+
+# HTML tag pattern, compiled once instead of per note
+_TAG_RE = re.compile(r'<[^>]+>')
+
+# Generated audio is cached here; user_files survives add-on updates
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'user_files', 'cache')
+
+
+def _clean_text(text: str) -> str:
+    """Strip HTML tags and collapse whitespace into single spaces.
+    split()/join is equivalent to re.sub(r'\s+', ' ', ...).strip() but runs
+    as one C-level pass without an extra regex scan."""
+    # Plain-text fields (no tag can start without '<') skip the regex entirely
+    if '<' in text:
+        text = _TAG_RE.sub('', text)
+    return ' '.join(text.split())
+
+
+def _is_quota_exhausted(error_msg: str) -> bool:
+    """True for errors that mean the account's quota is used up (e.g. Gemini's
+    per-day request limit or ElevenLabs' character quota), not a transient 429"""
+    msg = error_msg.lower()
+    return 'quota_exceeded' in msg or ('quota' in msg and ('perday' in msg or 'per day' in msg or 'daily' in msg))
+
+
+class _RequestPacer:
+    """Spaces API requests at least `interval` seconds apart across all pool threads,
+    so the configured wait is a real request rate however many workers run.
+    The interval adapts: it grows once per burst of rate-limit errors and eases
+    back to the configured value after a few successful requests."""
+
+    def __init__(self, interval: float, cancel_event: threading.Event):
+        self.base_interval = interval
+        self.interval = interval
+        self._cancel = cancel_event
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._success_streak = 0
+        self._last_backoff = None
+
+    def wait(self) -> bool:
+        """Block until this thread's slot comes up. Returns False if cancelled meanwhile."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            # Jitter keeps concurrent workers from retrying in lockstep after a backoff;
+            # it only ever widens the gap, so starts never come closer than the configured wait
+            interval = self.interval
+            if interval > self.base_interval:
+                interval *= random.uniform(1.0, 1.2)
+            self._next_slot = slot + interval
+        delay = slot - now
+        return not (delay > 0 and self._cancel.wait(delay))
+
+    def window(self, limit: int) -> int:
+        """How many requests to keep queued: the full limit at the configured
+        spacing, shrinking in proportion as rate limits widen it, down to one"""
+        reference = max(self.base_interval, PACER_MIN_BACKOFF)
+        if self.interval <= reference:
+            return limit
+        return max(1, int(limit * reference / self.interval))
+
+    def backoff(self):
+        """A request was rate limited: widen the spacing"""
+        with self._lock:
+            now = time.monotonic()
+            self._success_streak = 0
+            # Every worker and retry hit by the same burst reports it; only the
+            # first report counts, so one burst widens the spacing by one step
+            if self._last_backoff is not None and now - self._last_backoff < max(self.interval, PACER_BURST_WINDOW):
+                return
+            self._last_backoff = now
+            self.interval = min(max(self.interval * 1.5, PACER_MIN_BACKOFF), PACER_MAX_INTERVAL)
+
+    def success(self):
+        """A request went through: once a few have in a row, each one tightens the spacing again"""
+        with self._lock:
+            if self.interval <= self.base_interval:
+                return
+            self._success_streak += 1
+            if self._success_streak >= PACER_RECOVER_AFTER:
+                self.interval = max(self.base_interval, self.interval / 1.5)
+                # Below the smallest backoff step, go straight back to the configured spacing
+                if self.interval < PACER_MIN_BACKOFF:
+                    self.interval = self.base_interval
 
 
 class ProgressDialog(QDialog):
@@ -19,6 +135,14 @@ class ProgressDialog(QDialog):
         self.setup_ui(total_notes)
         self.handler_ref = None
         
+        # Log lines arrive in bursts from the worker; they are buffered and
+        # applied on a short timer so a burst costs one repaint.
+        self._pending_logs = deque()
+        self._log_timer = QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(100)
+        self._log_timer.timeout.connect(self.flush_logs)
+        
     def setup_ui(self, total_notes: int):
         self.setWindowTitle("Processing TTS")
         self.setMinimumWidth(700)
@@ -50,9 +174,11 @@ class ProgressDialog(QDialog):
         self.usage_label.setStyleSheet("color: #666;")
         layout.addWidget(self.usage_label)
         
-        # Log Box
-        self.log_text = QTextEdit()
+        # Log Box: plain-text widget with a capped line count, so appends stay
+        # cheap and memory is bounded on very large batches
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(LOG_MAX_LINES)
         font = QFont("Consolas", 10)
         font.setStyleHint(QFont.StyleHint.Monospace)
         self.log_text.setFont(font)
@@ -62,19 +188,38 @@ class ProgressDialog(QDialog):
         layout.addWidget(self.cancel_btn)
         self.setLayout(layout)
         
-    def update_progress(self, current_val: int, status: str, 
-                       success: int, failed: int, skipped: int):
+    def update_progress(self, current_val: int, stats_text: str):
+        # The worker throttles these and sends the stats line pre-formatted
         self.progress_bar.setValue(current_val)
-        self.status_label.setText(status)
-        self.stats_label.setText(f"Success: {success} | Skipped: {skipped} | Failed: {failed}")
+        self.stats_label.setText(stats_text)
         
     def update_usage(self, input_tokens, output_tokens):
         self.usage_label.setText(f"Session Usage - Input: {input_tokens} | Output: {output_tokens}")
         
     def add_log_html(self, html_msg: str):
-        self.log_text.append(html_msg)
-        sb = self.log_text.verticalScrollBar()
-        sb.setValue(sb.maximum())
+        self.add_log_lines([html_msg])
+        
+    def add_log_lines(self, lines: list):
+        self._pending_logs.extend(lines)
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+        
+    def flush_logs(self):
+        if not self._pending_logs:
+            return
+        # One block per line so the line cap applies; the widget keeps itself
+        # scrolled to the bottom while it is at the bottom. Updates are held
+        # off so the whole burst is laid out and painted once.
+        self.log_text.setUpdatesEnabled(False)
+        try:
+            while self._pending_logs:
+                self.log_text.appendHtml(self._pending_logs.popleft())
+        finally:
+            self.log_text.setUpdatesEnabled(True)
+        
+    def flush(self):
+        """Apply any buffered log output immediately"""
+        self.flush_logs()
 
     def closeEvent(self, event):
         if self.handler_ref and self.handler_ref.worker and self.handler_ref.worker.isRunning():
@@ -87,24 +232,31 @@ class ProgressDialog(QDialog):
 class TTSWorker(QThread):
     """Background worker thread that manages a thread pool for concurrent API requests"""
     
-    progress_update = pyqtSignal(int, str, int, int, int)
+    progress_update = pyqtSignal(int, str)  # processed count, stats line
     max_update = pyqtSignal(int)  # New signal to update progress bar range
     usage_update = pyqtSignal(int, int)
-    log_html_update = pyqtSignal(str) 
+    log_lines_update = pyqtSignal(list)  # HTML log lines, sent in batches
     finished_signal = pyqtSignal(str, dict)
+    # Carries a call to run on the main thread; see _run_on_main_sync
+    _main_call = pyqtSignal(object)
     
-    def __init__(self, note_ids, config, processor):
+    def __init__(self, note_ids, config):
         super().__init__()
+        # The worker object itself lives on the main thread, so a blocking queued
+        # connection runs the slot there while the emitting thread waits
+        self._main_call.connect(self._call_on_main, Qt.ConnectionType.BlockingQueuedConnection)
         self.note_ids = note_ids
         self.config = config
-        self.processor = processor
-        self.is_cancelled = False
+        # Built in run(), so client setup never blocks the GUI thread
+        self.processor = None
+        # Set from the GUI thread, read by the worker and pool threads
+        self._cancel = threading.Event()
         
-        # Organize config for fast lookup
-        self.note_type_map = defaultdict(list)
+        # Enabled (source, target) field pairs grouped by note type name, as configured
+        self._mappings_by_name = {}
         for cfg in config['note_type_configs']:
             if cfg.get('enabled', True):
-                self.note_type_map[cfg['note_type']].append(cfg)
+                self._mappings_by_name.setdefault(cfg['note_type'], []).append((cfg['source_field'], cfg['target_field']))
         
         self.total_input_tokens = 0
         self.total_output_tokens = 0
@@ -114,24 +266,103 @@ class TTSWorker(QThread):
         self.failed_ops = 0
         self.skipped_ops = 0
         self.processed_count = 0
+        # Updates for the dialog are collected here and sent at most every
+        # PROGRESS_INTERVAL seconds; see _flush_updates
+        self._pending_logs = []
+        self._last_flush = 0.0
+        self._last_progress = None
+        self._last_usage = (0, 0)
+        
+        # mid -> mappings as (source index, source name, target index, target name)
+        # tuples for every mapped note type. Keyed by the model id, which stays
+        # stable if the note type is renamed mid-run.
+        self.note_type_map = {}
+        
+        # Audio cache, plus requests currently being generated (key -> Future of audio)
+        self.cache = None
+        self._media_dir = ''
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
 
-    def _run_on_main_sync(self, func):
-        """Run a function on the main thread and wait for result"""
-        container = {'result': None, 'error': None}
-        event = threading.Event()
+    def cancel(self):
+        """Ask the worker to stop; safe to call from any thread"""
+        self._cancel.set()
+
+    def _create_processor(self) -> TTSProcessor:
+        el_config = self.config.get('elevenlabs', {})
+        return TTSProcessor(
+            service=self.config.get('service', 'gemini'),
+            api_key=self.config['api_key'],
+            voice_name=self.config.get('voice_name', 'Zephyr'),
+            language_code=self.config.get('language_code', ''),
+            temperature=self.config.get('temperature', 1.0),
+            system_instruction=self.config.get('system_instruction', ''),
+            elevenlabs_api_key=el_config.get('api_key', ''),
+            elevenlabs_voice_id=el_config.get('voice_id', ''),
+            elevenlabs_model=el_config.get('model_id', 'eleven_turbo_v2_5'),
+            elevenlabs_speed=el_config.get('speed', 1.0),
+            elevenlabs_language_code=el_config.get('language_code', ''),
+            max_connections=self.config.get('max_concurrent', 1),
+            empty_result_ttl=self.config.get('empty_result_ttl', 10) * 60
+        )
+
+    def _run_on_main(self, func) -> concurrent.futures.Future:
+        """Schedule a function on the main thread and return a Future for its result"""
+        fut = concurrent.futures.Future()
         def wrapper():
             try:
-                container['result'] = func()
-            except Exception as e:
-                container['error'] = e
-            finally:
-                event.set()
+                fut.set_result(func())
+            except BaseException as e:
+                fut.set_exception(e)
         mw.taskman.run_on_main(wrapper)
-        if not event.wait(timeout=30):
-            raise TimeoutError("Main thread operation timed out")
-        if container['error']:
-            raise container['error']
-        return container['result']
+        return fut
+
+    def _call_on_main(self, call):
+        try:
+            call['result'] = call['func']()
+        except Exception as e:
+            call['error'] = e
+
+    def _run_on_main_sync(self, func):
+        """Run a function on the main thread and wait for result.
+        Qt blocks the calling thread until the slot returns, so no Future or
+        timeout bookkeeping is needed."""
+        call = {'func': func}
+        self._main_call.emit(call)
+        if 'error' in call:
+            raise call['error']
+        return call.get('result')
+
+    def _log(self, html_msg: str):
+        self._pending_logs.append(html_msg)
+        self._flush_updates()
+
+    def _flush_updates(self, force: bool = False):
+        """Send queued log lines, counters and usage to the dialog, at most every
+        PROGRESS_INTERVAL seconds unless forced, so a fast stream of results
+        costs the GUI thread a few signals per second rather than several per note"""
+        now = time.monotonic()
+        if not force and now - self._last_flush < PROGRESS_INTERVAL:
+            return
+        self._last_flush = now
+        
+        if self._pending_logs:
+            self.log_lines_update.emit(self._pending_logs)
+            self._pending_logs = []
+        
+        usage = (self.total_input_tokens, self.total_output_tokens)
+        if usage != self._last_usage:
+            self._last_usage = usage
+            self.usage_update.emit(*usage)
+        
+        # Nothing to repaint if no counter moved since the last update
+        progress = (self.processed_count, self.success_ops, self.skipped_ops, self.failed_ops)
+        if progress != self._last_progress:
+            self._last_progress = progress
+            self.progress_update.emit(
+                self.processed_count,
+                f"Success: {self.success_ops} | Skipped: {self.skipped_ops} | Failed: {self.failed_ops}"
+            )
 
     def _format_error(self, error_str: str) -> str:
         error_str = str(error_str)
@@ -139,113 +370,278 @@ class TTSWorker(QThread):
             return f"{error_str[:150]}..."
         return error_str
 
-    def run(self):
-        # 1. Prepare Work Items
-        self.log_html_update.emit("Scanning notes...")
+    def _generate_cached(self, text, generate):
+        """Serve text from the audio cache, coalescing concurrent requests for identical text.
+        Returns (audio, model_info, stats, filename); audio is None when the cached
+        media file is still in the collection and can be referenced as-is."""
+        signature = self.processor.cache_signature(self.config.get('primary_model', ''))
+        key = AudioCache.make_key(text, *signature)
+        
+        with self._inflight_lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = concurrent.futures.Future()
+        
+        if pending is not None:
+            # Another worker is already generating this text
+            audio, filename = pending.result()
+            if audio or filename:
+                return audio, 'cached', {}, filename
+            return generate(text) + (None,)
+        
+        audio_data = filename = None
+        try:
+            # Audio saved to media before needs neither reading back nor writing again
+            filename = self.cache.get_filename(key)
+            if filename and os.path.exists(os.path.join(self._media_dir, filename)):
+                return None, 'cached', {}, filename
+            filename = None
+            
+            audio_data = self.cache.get(key)
+            if audio_data:
+                return audio_data, 'cached', {}, None
+            
+            audio_data, model_info, stats = generate(text)
+            if audio_data:
+                filename = self._media_filename(audio_data)
+                # Lookups only use the primary model's key, so audio from the
+                # fallback model is not cached; later runs ask the primary again
+                if self.processor.cache_signature(model_info) == signature:
+                    try:
+                        self.cache.put(key, audio_data, filename)
+                    except Exception:
+                        pass
+            return audio_data, model_info, stats, filename
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key).set_result((audio_data, filename))
+
+    def _resolve_note_types(self):
+        """Resolve mapped note type names to model ids and fields once, and look up the
+        type of every selected note with one query (runs on the main thread).
+        Returns a dict of note id -> mid for the selected notes of mapped types."""
+        self._media_dir = mw.col.media.dir()
+        for name, mappings in self._mappings_by_name.items():
+            model = mw.col.models.by_name(name)
+            if not model:
+                continue
+            # Field positions are resolved once, so notes are read by index. A
+            # mapping whose source field doesn't exist can never produce work.
+            index = {f['name']: i for i, f in enumerate(model['flds'])}
+            resolved = [(index[src], src, index.get(tgt), tgt) for src, tgt in mappings if src in index]
+            if resolved:
+                self.note_type_map[model['id']] = resolved
+        
+        if not self.note_type_map:
+            return {}
+        return dict(mw.col.db.all(
+            f"SELECT id, mid FROM notes WHERE id IN {ids2str(self.note_ids)} "
+            f"AND mid IN {ids2str(self.note_type_map)}"
+        ))
+
+    def _fetch_notes_batch(self, note_ids):
+        """Fetch raw field data for a slice of notes with one query (runs on the main thread).
+        Notes of unmapped types are filtered out by the query itself."""
+        return mw.col.db.all(
+            f"SELECT id, mid, flds FROM notes WHERE id IN {ids2str(note_ids)} "
+            f"AND mid IN {ids2str(self.note_type_map)}"
+        )
+
+    def _build_work_items(self, rows):
+        """Build work items from raw note rows, without touching the collection.
+        Returns (work_items, skipped_count)."""
+        tasks = []
+        skipped = 0
+        skip_existing = self.config.get('skip_existing_audio', True)
+        verbose = self.config.get('verbose_logging', False)
+        for nid, mid, flds in rows:
+            if self._cancel.is_set(): break
+            
+            fields = flds.split('\x1f')
+            for src_idx, src, tgt_idx, tgt in self.note_type_map[mid]:
+                # Check existing
+                if skip_existing and tgt_idx is not None:
+                    if '[sound:' in fields[tgt_idx]:
+                        skipped += 1
+                        if verbose:
+                            self._log(f"<span style='color:gray'>Note {nid} ({src}): Skipped (Audio exists)</span>")
+                        continue
+                
+                clean_text = _clean_text(fields[src_idx])
+                
+                if not clean_text:
+                    skipped += 1
+                    continue
+                    
+                tasks.append({
+                    'nid': nid,
+                    'src_field': src,
+                    'tgt_field': tgt,
+                    'text': clean_text
+                })
+        return tasks, skipped
+
+    def _media_filename(self, audio_data: bytes) -> str:
+        """Content-addressed media name: collision-free without timestamps, and
+        identical audio maps to one media file"""
+        svc_prefix = "elevenlabs" if self.processor.service == "elevenlabs" else "gemini"
+        digest = hashlib.blake2b(audio_data, digest_size=10).hexdigest()
+        return f"{svc_prefix}_tts_{digest}.wav"
+
+    def _save_results_batch(self, results):
+        """Write audio for a batch of results and update all touched notes at once (runs on the main thread).
+        Returns a list of (result, error) pairs."""
+        tag = self.config.get('tag_on_success', '')
         
-        work_items = []
+        notes = {}
+        outcomes = []
+        for res in results:
+            item = res['item']
+            try:
+                # Names are content hashes, so an existing file already holds this audio
+                filename = res['filename']
+                if not mw.col.media.have(filename):
+                    if not res['audio']:
+                        raise Exception(f"Media file {filename} is missing")
+                    filename = mw.col.media.write_data(filename, res['audio'])
+                # The audio is on disk now; don't keep it alive until the batch is logged
+                res['audio'] = None
+                
+                # Several mappings can target the same note; update it only once
+                n = notes.get(item['nid'])
+                if n is None:
+                    n = notes[item['nid']] = mw.col.get_note(item['nid'])
+                n[item['tgt_field']] = f"[sound:{filename}]"
+                if tag: n.add_tag(tag)
+                outcomes.append((res, None))
+            except Exception as e:
+                outcomes.append((res, str(e)))
         
-        def prepare_tasks():
-            tasks = []
-            for nid in self.note_ids:
-                if self.is_cancelled: break
-                try:
-                    note = mw.col.get_note(nid)
-                    model_name = note.note_type()['name']
-                    
-                    if model_name in self.note_type_map:
-                        for map_cfg in self.note_type_map[model_name]:
-                            src = map_cfg['source_field']
-                            tgt = map_cfg['target_field']
-                            
-                            if src not in note:
-                                continue
-                                
-                            # Check existing
-                            if self.config.get('skip_existing_audio', True):
-                                if tgt in note and '[sound:' in note[tgt]:
-                                    self.skipped_ops += 1
-                                    if self.config.get('verbose_logging', False):
-                                        self.log_html_update.emit(f"<span style='color:gray'>Note {nid} ({src}): Skipped (Audio exists)</span>")
-                                    continue
-                            
-                            text = note[src]
-                            clean_text = re.sub(r'<[^>]+>', '', text)
-                            clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-                            
-                            if not clean_text:
-                                self.skipped_ops += 1
-                                continue
-                                
-                            tasks.append({
-                                'nid': nid,
-                                'src_field': src,
-                                'tgt_field': tgt,
-                                'text': clean_text,
-                                'raw_text': text
-                            })
-                except Exception:
-                    continue
-            return tasks
+        if notes:
+            try:
+                mw.col.update_notes(list(notes.values()))
+            except Exception as e:
+                outcomes = [(res, err or str(e)) for res, err in outcomes]
+        return outcomes
 
+    def run(self):
+        # 1. Work items are read one slice of notes per main-thread hop. The next
+        # slice is already being read while the current one is generated, so
+        # note reads stay off the critical path.
+        self.processor = self._create_processor()
+        self._log("Scanning notes...")
+        
         try:
-            work_items = self._run_on_main_sync(prepare_tasks)
+            note_mids = self._run_on_main_sync(self._resolve_note_types)
         except Exception as e:
-            self.log_html_update.emit(f"<span style='color:red'>Error scanning notes: {str(e)}</span>")
-            return
-
-        # 2. Update Progress Bar Range
-        # Total operations = items to process + items already skipped
-        total_ops = len(work_items) + self.skipped_ops
+            note_mids = {}
+            self._log(f"<span style='color:red'>Error reading note types: {str(e)}</span>")
+        
+        # Only notes of mapped types are read, keeping the selection order; notes
+        # of other types cost no main-thread work at all
+        note_ids = [nid for nid in self.note_ids if nid in note_mids]
+        slices = [note_ids[i:i + NOTE_BATCH_SIZE] for i in range(0, len(note_ids), NOTE_BATCH_SIZE)]
+        
+        # 2. The progress range is known up front: one operation per mapping of
+        # each note. It is corrected per slice if notes were changed or deleted meanwhile.
+        def expected_ops(ids):
+            return sum(len(self.note_type_map[note_mids[nid]]) for nid in ids)
+        
+        total_ops = expected_ops(note_ids)
         self.max_update.emit(total_ops)
         
-        # Start progress at skipped count
-        self.processed_count = self.skipped_ops
-        self.progress_update.emit(self.processed_count, "Starting...", self.success_ops, self.failed_ops, self.skipped_ops)
+        def read_slice(idx):
+            return self._run_on_main(lambda: self._fetch_notes_batch(slices[idx]))
         
-        total_items = len(work_items)
-        if total_items == 0:
-            # If everything was skipped, we are done
-            self.progress_update.emit(total_ops, "Done", self.success_ops, self.failed_ops, self.skipped_ops)
-            summary = f"<br><b>Processing Complete!</b><br>Skipped: {self.skipped_ops}"
-            self.finished_signal.emit(summary, {})
-            return
+        def iter_work_items():
+            nonlocal total_ops
+            next_read = read_slice(0) if slices else None
+            for idx in range(len(slices)):
+                if self._cancel.is_set(): return
+                try:
+                    rows = next_read.result(timeout=30)
+                except Exception as e:
+                    self._log(f"<span style='color:red'>Error scanning notes: {str(e)}</span>")
+                    return
+                # Don't queue another read on the main thread once cancelled
+                if self._cancel.is_set(): return
+                next_read = read_slice(idx + 1) if idx + 1 < len(slices) else None
+                items, skipped = self._build_work_items(rows)
+                
+                # Total operations = items to process + items skipped
+                shortfall = expected_ops(slices[idx]) - (len(items) + skipped)
+                if shortfall:
+                    total_ops -= shortfall
+                    self.max_update.emit(total_ops)
+                self.skipped_ops += skipped
+                self.processed_count += skipped
+                self._flush_updates()
+                
+                # Longest texts first, so a slow request doesn't start last and
+                # leave the other workers idle at the end of the slice
+                items.sort(key=lambda t: len(t['text']), reverse=True)
+                yield from items
 
-        # 3. Configure Thread Pool
+        # 3. Configure Thread Pool. The API client is set up here, once, rather
+        # than by whichever pool thread happens to send the first request.
+        if slices:
+            try:
+                self.processor.initialize_client()
+            except Exception as e:
+                self._log(f"<span style='color:red'>Error initializing client: {str(e)}</span>")
+        
         max_workers = self.config.get('max_concurrent', 1)
         request_wait = self.config.get('request_wait', 0.1)
-        tag = self.config.get('tag_on_success', '')
-        
-        svc_prefix = "elevenlabs" if self.processor.service == "elevenlabs" else "gemini"
+
+        if self.config.get('cache_enabled', True):
+            try:
+                self.cache = AudioCache(CACHE_DIR, int(self.config.get('cache_max_mb', 500)) * 1024 * 1024)
+            except Exception as e:
+                self._log(f"<span style='color:orange'>Audio cache unavailable: {str(e)}</span>")
 
         # 4. Execution Function
+        check_cancel = self._cancel.is_set
+        pacer = _RequestPacer(request_wait, self._cancel)
+
+        def generate(text):
+            # Every attempt, retries and fallback included, waits for its pacer slot
+            result = self.processor.generate_with_fallback(
+                text,
+                self.config.get('primary_model', ''),
+                self.config.get('fallback_model', ''),
+                self.config.get('enable_fallback', True),
+                self.config.get('retry_attempts', 3),
+                self.config.get('retry_delay', 2),
+                self.config.get('retry_on_empty', False),
+                check_cancel,
+                pacer.backoff,
+                pacer.wait,
+                self._cancel
+            )
+            if result[0]:
+                pacer.success()
+            elif self._cancel.is_set():
+                return None, "Cancelled", {}
+            return result
+
         def process_item(item):
-            if self.is_cancelled: return None
-            
-            if request_wait > 0:
-                time.sleep(request_wait)
+            if self._cancel.is_set(): return None
 
             result = {
                 'item': item,
                 'audio': None,
+                'filename': None,
                 'model': '',
                 'stats': {},
                 'error': None
             }
-            
-            check_cancel = lambda: self.is_cancelled
 
             try:
-                audio_data, model_info, stats = self.processor.generate_with_fallback(
-                    item['text'],
-                    self.config.get('primary_model', ''),
-                    self.config.get('fallback_model', ''),
-                    self.config.get('enable_fallback', True),
-                    self.config.get('retry_attempts', 3),
-                    self.config.get('retry_delay', 2),
-                    self.config.get('retry_on_empty', False),
-                    check_cancel
-                )
+                if self.cache:
+                    audio_data, model_info, stats, filename = self._generate_cached(item['text'], generate)
+                    result['filename'] = filename
+                else:
+                    audio_data, model_info, stats = generate(item['text'])
                 
                 result['audio'] = audio_data
                 result['model'] = model_info
@@ -256,68 +652,164 @@ class TTSWorker(QThread):
                 
             return result
 
-        # 5. Start Processing Loop
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_item = {executor.submit(process_item, item): item for item in work_items}
+        # 5. Saving: finished audio is buffered and written in batches
+        pending_saves = []
+        pending_since = 0.0
+
+        def flush_saves():
+            if not pending_saves: return
+            batch = list(pending_saves)
+            pending_saves.clear()
             
-            for future in concurrent.futures.as_completed(future_to_item):
-                if self.is_cancelled:
-                    break
+            try:
+                outcomes = self._run_on_main_sync(lambda: self._save_results_batch(batch))
+            except Exception as e:
+                outcomes = [(res, str(e)) for res in batch]
+            
+            for res, save_err in outcomes:
+                item = res['item']
+                if save_err is None:
+                    self.success_ops += 1
+                    self._log(
+                        f"Note {item['nid']} ({item['src_field']}): "
+                        f"<span style='color:green; font-weight:bold'>Success ({res['model']})</span>"
+                    )
+                else:
+                    self.failed_ops += 1
+                    self._log(f"<span style='color:red'>Note {item['nid']}: Save Error - {save_err}</span>")
+                
+                self.processed_count += 1
+            self._flush_updates()
 
-                try:
-                    res = future.result()
-                    if not res: continue
+        def queue_save(res):
+            nonlocal pending_since
+            if not pending_saves:
+                pending_since = time.monotonic()
+            pending_saves.append(res)
+            if len(pending_saves) >= NOTE_BATCH_SIZE:
+                flush_saves()
 
-                    item = res['item']
-                    stats = res.get('stats', {})
-                    
-                    if stats:
-                        self.total_input_tokens += stats.get('input_tokens', 0)
-                        self.total_output_tokens += stats.get('output_tokens', 0)
-                        if res['audio']:
-                            self.total_requests += 1
-                        self.usage_update.emit(self.total_input_tokens, self.total_output_tokens)
-                    
+        # 6. Identical text within this run is requested only once: later items wait
+        # for the first one and reuse its media file
+        dedupe = self.config.get('dedupe_within_batch', True)
+        seen_texts = {}  # clean text -> media filename, or items waiting on the first request
+        requeue = deque()  # waiting items whose first request failed
+
+        def next_item():
+            while True:
+                item = requeue.popleft() if requeue else next(items_iter, None)
+                if item is None or not dedupe:
+                    return item
+                
+                prior = seen_texts.get(item['text'])
+                if prior is None:
+                    seen_texts[item['text']] = []
+                    return item
+                if isinstance(prior, list):
+                    prior.append(item)
+                else:
+                    queue_save({'item': item, 'audio': None, 'filename': prior,
+                                'model': 'duplicate', 'stats': {}, 'error': None})
+
+        # 7. Handle one finished request
+        quota_errors = 0  # consecutive failures caused by an exhausted quota
+
+        def handle_result(future):
+            nonlocal quota_errors
+            try:
+                res = future.result()
+                if not res: return
+
+                item = res['item']
+                stats = res.get('stats', {})
+                
+                if stats:
+                    self.total_input_tokens += stats.get('input_tokens', 0)
+                    self.total_output_tokens += stats.get('output_tokens', 0)
                     if res['audio']:
-                        def save_audio_to_note():
-                            try:
-                                filename = f"{svc_prefix}_tts_{item['nid']}_{int(time.time()*1000)}.wav"
-                                mw.col.media.write_data(filename, res['audio'])
-                                
-                                n = mw.col.get_note(item['nid'])
-                                n[item['tgt_field']] = f"[sound:{filename}]"
-                                if tag: n.add_tag(tag)
-                                mw.col.update_note(n)
-                                return True, None
-                            except Exception as e:
-                                return False, str(e)
-
-                        saved, save_err = self._run_on_main_sync(save_audio_to_note)
-                        
-                        if saved:
-                            self.success_ops += 1
-                            self.log_html_update.emit(
-                                f"Note {item['nid']} ({item['src_field']}): "
-                                f"<span style='color:green; font-weight:bold'>Success ({res['model']})</span>"
-                            )
-                        else:
-                            self.failed_ops += 1
-                            self.log_html_update.emit(f"<span style='color:red'>Note {item['nid']}: Save Error - {save_err}</span>")
-                    
-                    else:
-                        self.failed_ops += 1
-                        err_msg = res.get('error') or res.get('model') or "Unknown Error"
-                        display_err = self._format_error(err_msg)
-                        self.log_html_update.emit(f"Note {item['nid']} ({item['src_field']}): <span style='color:red'>{display_err}</span>")
+                        self.total_requests += 1
+                
+                if res['audio'] or res['filename']:
+                    quota_errors = 0
+                    if not res['filename']:
+                        res['filename'] = self._media_filename(res['audio'])
+                    queue_save(res)
+                    if dedupe:
+                        waiting = seen_texts.get(item['text'])
+                        seen_texts[item['text']] = res['filename']
+                        for dup in waiting or ():
+                            queue_save(dict(res, item=dup, stats={}))
+                    return
+                
+                # Items waiting on this text get their own attempt
+                if dedupe:
+                    requeue.extend(seen_texts.pop(item['text'], None) or ())
+                
+                self.failed_ops += 1
+                err_msg = res.get('error') or res.get('model') or "Unknown Error"
+                display_err = self._format_error(err_msg)
+                self._log(f"Note {item['nid']} ({item['src_field']}): <span style='color:red'>{display_err}</span>")
+                
+                # An exhausted daily quota won't recover during this run; stop
+                # instead of failing every remaining note one request at a time
+                quota_errors = quota_errors + 1 if _is_quota_exhausted(err_msg) else 0
+                if quota_errors >= QUOTA_ABORT_AFTER and not self._cancel.is_set():
+                    self._log("<span style='color:red; font-weight:bold'>Daily quota exhausted, stopping the batch.</span>")
+                    self._cancel.set()
 
-                except Exception as exc:
-                    self.failed_ops += 1
-                    self.log_html_update.emit(f"<span style='color:red'>Worker Exception: {str(exc)}</span>")
+            except Exception as exc:
+                self.failed_ops += 1
+                self._log(f"<span style='color:red'>Worker Exception: {str(exc)}</span>")
+            
+            self.processed_count += 1
+            self._flush_updates()
+
+        # 8. Start Processing Loop
+        # Only a bounded window of requests is queued ahead of the workers, so a
+        # cancel never has to drain a backlog of already-submitted items.
+        max_in_flight = max_workers * 2
+        items_iter = iter_work_items()
+        in_flight = set()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while not self._cancel.is_set():
+                # While rate limited, fewer requests are queued the wider the
+                # pacer's spacing, so a cancel or quota stop has less to drain
+                window = pacer.window(max_in_flight)
+                while len(in_flight) < window:
+                    item = next_item()
+                    if item is None: break
+                    in_flight.add(executor.submit(process_item, item))
                 
-                self.processed_count += 1
-                self.progress_update.emit(self.processed_count, "Processing...", self.success_ops, self.failed_ops, self.skipped_ops)
+                if not in_flight:
+                    break
+                
+                # Wake up periodically so updates held back by the throttle are
+                # still sent while every worker is waiting on a slow request
+                done, in_flight = concurrent.futures.wait(
+                    in_flight, timeout=PROGRESS_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    handle_result(future)
+                
+                # With slow requests a batch can take long to fill; save what is
+                # there so notes don't sit unsaved
+                if pending_saves and time.monotonic() - pending_since > SAVE_MAX_DELAY:
+                    flush_saves()
+                self._flush_updates()
+        finally:
+            # On cancel, drop queued requests and don't wait for in-flight ones
+            executor.shutdown(wait=not self._cancel.is_set(), cancel_futures=True)
+
+        # Audio that was already generated is still saved after a cancel
+        flush_saves()
+        self._flush_updates(force=True)
 
-        # 6. Finalize
+        if self.cache:
+            self.cache.close()
+        self.processor.close()
+
+        # 9. Finalize
         summary = f"<br><b>Processing Complete!</b><br>"
         summary += f"<span style='color:green'>Success: {self.success_ops}</span><br>"
         summary += f"<span style='color:gray'>Skipped: {self.skipped_ops}</span><br>"
@@ -339,7 +831,13 @@ class BatchTTSHandler:
         self.mw = mw
         self.note_ids = note_ids
         self.global_config = mw.addonManager.getConfig(__name__) or {}
-        
+        self._load_active_config()
+
+        self.dialog = None
+        self.worker = None
+
+    def _load_active_config(self):
+        """Pick the active profile out of self.global_config"""
         self.profile_name = self.global_config.get('current_profile', 'Default')
         profiles = self.global_config.get('profiles', {})
         
@@ -347,9 +845,6 @@ class BatchTTSHandler:
             self.active_config = self.global_config
         else:
             self.active_config = profiles.get(self.profile_name, self.get_default_config())
-
-        self.dialog = None
-        self.worker = None
             
     def get_default_config(self):
         return {
@@ -365,7 +860,11 @@ class BatchTTSHandler:
             'max_concurrent': 1,
             'retry_on_empty': False,
             'verbose_logging': False,
+            'dedupe_within_batch': True,
             'tag_on_success': '',
+            'cache_enabled': True,
+            'cache_max_mb': 500,
+            'empty_result_ttl': 10,
             'note_type_configs': [],
             'stats': {'requests': 0, 'input_tokens': 0, 'output_tokens': 0},
             'elevenlabs': {
@@ -393,53 +892,38 @@ class BatchTTSHandler:
             if dialog.exec():
                 self.global_config = dialog.get_config()
                 self.mw.addonManager.writeConfig(__name__, self.global_config)
-                self.__init__(self.mw, self.note_ids)
+                self._load_active_config()
                 if not self.validate_config(): return 
             else:
                 return
         
-        service = self.active_config.get('service', 'gemini')
-        el_config = self.active_config.get('elevenlabs', {})
-
-        processor = TTSProcessor(
-            service=service,
-            api_key=self.active_config['api_key'],
-            voice_name=self.active_config.get('voice_name', 'Zephyr'),
-            language_code=self.active_config.get('language_code', ''),
-            temperature=self.active_config.get('temperature', 1.0),
-            system_instruction=self.active_config.get('system_instruction', ''),
-            elevenlabs_api_key=el_config.get('api_key', ''),
-            elevenlabs_voice_id=el_config.get('voice_id', ''),
-            elevenlabs_model=el_config.get('model_id', 'eleven_turbo_v2_5'),
-            elevenlabs_speed=el_config.get('speed', 1.0),
-            elevenlabs_language_code=el_config.get('language_code', '')
-        )
-        
         # Initialize dialog with estimated note count first
         self.dialog = ProgressDialog(self.mw, len(self.note_ids))
         self.dialog.cancel_btn.clicked.connect(self.on_cancel)
         self.dialog.handler_ref = self 
+        self.dialog.status_label.setText("Processing...")
         self.dialog.show()
         
-        self.worker = TTSWorker(self.note_ids, self.active_config, processor)
+        self.worker = TTSWorker(self.note_ids, self.active_config)
         
         # Connect signals
         self.worker.progress_update.connect(self.dialog.update_progress)
         self.worker.max_update.connect(self.dialog.progress_bar.setMaximum) # Correctly update Range
         self.worker.usage_update.connect(self.dialog.update_usage)
-        self.worker.log_html_update.connect(self.dialog.add_log_html)
+        self.worker.log_lines_update.connect(self.dialog.add_log_lines)
         self.worker.finished_signal.connect(self.on_finished)
         
         self.worker.start()
         
     def on_cancel(self):
         if self.worker and self.worker.isRunning():
-            self.worker.is_cancelled = True
+            self.worker.cancel()
             self.dialog.cancel_btn.setEnabled(False)
             self.dialog.status_label.setText("Cancelling...")
             
     def on_finished(self, summary, session_stats):
         self.dialog.add_log_html(summary)
+        self.dialog.flush()
         self.dialog.status_label.setText("Done")
         
         self.dialog.cancel_btn.setText("Close")
@@ -448,6 +932,11 @@ class BatchTTSHandler:
         except: pass
         self.dialog.cancel_btn.clicked.connect(self.close_and_cleanup)
         
+        # Nothing was sent, so there are no stats to persist
+        if not any(session_stats.values()) and 'profiles' in self.global_config:
+            self.mw.reset()
+            return
+        
         current_stats = self.active_config.get('stats', {'requests': 0, 'input_tokens': 0, 'output_tokens': 0})
         current_stats['requests'] = current_stats.get('requests', 0) + session_stats['requests']
         current_stats['input_tokens'] = current_stats.get('input_tokens', 0) + session_stats['input_tokens']
@@ -1,3 +1,5 @@
+import bisect
+
 from aqt.qt import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
                      QPushButton, QComboBox, QCheckBox, QGroupBox, QFormLayout,
                      QListWidget, QListWidgetItem, QDialogButtonBox, QSpinBox,
@@ -31,10 +33,11 @@ class SectionHeader(QLabel):
 class NoteTypeConfigDialog(QDialog):
     """Dialog for configuring field mappings for a note type"""
     
-    def __init__(self, parent, note_type_name, existing_config=None):
+    def __init__(self, parent, note_type_name, existing_config=None, fields=None):
         super().__init__(parent)
         self.note_type_name = note_type_name
         self.config = existing_config or {}
+        self.fields = fields
         self.setup_ui()
         
     def setup_ui(self):
@@ -42,13 +45,14 @@ class NoteTypeConfigDialog(QDialog):
         self.setMinimumWidth(400)
         layout = QVBoxLayout()
         
-        model = mw.col.models.by_name(self.note_type_name)
-        if not model:
+        fields = self.fields
+        if fields is None:
+            model = mw.col.models.by_name(self.note_type_name)
+            fields = [f['name'] for f in model['flds']] if model else None
+        if not fields:
             showInfo(f"Note type '{self.note_type_name}' not found")
             self.reject()
             return
-            
-        fields = [f['name'] for f in model['flds']]
         
         self.enabled_chk = QCheckBox("Enable this mapping")
         self.enabled_chk.setChecked(self.config.get('enabled', True))
@@ -56,6 +60,8 @@ class NoteTypeConfigDialog(QDialog):
         
         form = QFormLayout()
         self.source_field = QComboBox()
+        self.source_field.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        self.source_field.setMinimumContentsLength(20)
         self.source_field.addItems(fields)
         if self.config.get('source_field'):
             idx = self.source_field.findText(self.config['source_field'])
@@ -63,6 +69,8 @@ class NoteTypeConfigDialog(QDialog):
         form.addRow("Source (Text):", self.source_field)
         
         self.target_field = QComboBox()
+        self.target_field.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        self.target_field.setMinimumContentsLength(20)
         self.target_field.addItems(fields)
         if self.config.get('target_field'):
             idx = self.target_field.findText(self.config['target_field'])
@@ -107,6 +115,10 @@ class ConfigDialog(QDialog):
             self.profiles['Default'] = self.get_default_profile()
             self.current_profile_name = 'Default'
 
+        # Note type names and fields, looked up once per dialog instead of per click
+        self._note_type_names = None
+        self._note_type_fields = {}
+
         self.setup_ui()
         self.load_profile(self.current_profile_name)
         
@@ -139,6 +151,10 @@ class ConfigDialog(QDialog):
             'tag_on_success': '',
             'retry_on_empty': False,
             'verbose_logging': False,
+            'dedupe_within_batch': True,
+            'cache_enabled': True,
+            'cache_max_mb': 500,
+            'empty_result_ttl': 10,
             'stats': {'requests': 0, 'input_tokens': 0, 'output_tokens': 0}
         }
         
@@ -154,7 +170,12 @@ class ConfigDialog(QDialog):
         top_bar.addWidget(QLabel("Profile:"))
         
         self.profile_combo = QComboBox()
-        self.profile_combo.addItems(sorted(self.profiles.keys()))
+        # Size from a fixed character count rather than measuring every item
+        self.profile_combo.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        self.profile_combo.setMinimumContentsLength(20)
+        # Kept in step with the combo rows, so names can be placed by bisection
+        self._profile_names = sorted(self.profiles)
+        self.profile_combo.addItems(self._profile_names)
         self.profile_combo.setCurrentText(self.current_profile_name)
         self.profile_combo.currentTextChanged.connect(self.on_profile_change)
         top_bar.addWidget(self.profile_combo, 1)
@@ -350,7 +371,8 @@ class ConfigDialog(QDialog):
         self.request_wait.setRange(0.0, 10.0)
         self.request_wait.setSingleStep(0.1)
         self.request_wait.setSuffix(" sec")
-        perf_form.addRow("Delay after request:", self.request_wait)
+        self.request_wait.setToolTip("Minimum time between the start of two requests, shared by all concurrent requests.")
+        perf_form.addRow("Delay between requests:", self.request_wait)
         
         layout.addLayout(perf_form)
         
@@ -366,6 +388,12 @@ class ConfigDialog(QDialog):
         self.verbose_logging = QCheckBox("Verbose logging (show skipped notes)")
         layout.addWidget(self.verbose_logging)
 
+        self.dedupe_within_batch = QCheckBox("Generate identical text only once per batch")
+        layout.addWidget(self.dedupe_within_batch)
+
+        self.cache_enabled = QCheckBox("Reuse cached audio for identical text and voice settings")
+        layout.addWidget(self.cache_enabled)
+
         logic_form = QFormLayout()
         self.tag_on_success = QLineEdit()
         self.tag_on_success.setPlaceholderText("Optional (e.g., tts_generated)")
@@ -379,6 +407,18 @@ class ConfigDialog(QDialog):
         self.retry_delay.setRange(1, 30)
         logic_form.addRow("Retry Delay (sec):", self.retry_delay)
         
+        self.cache_max_mb = QSpinBox()
+        self.cache_max_mb.setRange(10, 10000)
+        self.cache_max_mb.setSuffix(" MB")
+        logic_form.addRow("Audio Cache Size:", self.cache_max_mb)
+        
+        self.empty_result_ttl = QSpinBox()
+        self.empty_result_ttl.setRange(0, 1440)
+        self.empty_result_ttl.setSuffix(" min")
+        self.empty_result_ttl.setSpecialValueText("Off")
+        self.empty_result_ttl.setToolTip("Skip text that came back without audio for this long instead of requesting it again.")
+        logic_form.addRow("Skip Empty Results For:", self.empty_result_ttl)
+        
         layout.addLayout(logic_form)
         
         # Stats
@@ -409,7 +449,7 @@ class ConfigDialog(QDialog):
         note_configs = []
         for i in range(self.note_configs.count()):
             item = self.note_configs.item(i)
-            note_configs.append(item.data(0x0100))
+            note_configs.append(item.data(Qt.ItemDataRole.UserRole))
 
         # Save Gemini settings
         profile_data = {
@@ -431,6 +471,10 @@ class ConfigDialog(QDialog):
             'tag_on_success': self.tag_on_success.text(),
             'retry_on_empty': self.retry_on_empty.isChecked(),
             'verbose_logging': self.verbose_logging.isChecked(),
+            'dedupe_within_batch': self.dedupe_within_batch.isChecked(),
+            'cache_enabled': self.cache_enabled.isChecked(),
+            'cache_max_mb': self.cache_max_mb.value(),
+            'empty_result_ttl': self.empty_result_ttl.value(),
             'stats': current_stats
         }
 
@@ -448,7 +492,17 @@ class ConfigDialog(QDialog):
         self.profiles[self.current_profile_name] = profile_data
 
     def load_profile(self, name):
-        p = self.profiles.get(name, self.get_default_profile())
+        # Every setter below may repaint; hold updates so a switch is drawn once
+        self.setUpdatesEnabled(False)
+        try:
+            self._apply_profile(name)
+        finally:
+            self.setUpdatesEnabled(True)
+
+    def _apply_profile(self, name):
+        p = self.profiles.get(name)
+        if p is None:
+            p = self.get_default_profile()
         self.profile_combo.blockSignals(True)
         self.profile_combo.setCurrentText(name)
         self.profile_combo.blockSignals(False)
@@ -488,8 +542,12 @@ class ConfigDialog(QDialog):
         self.tag_on_success.setText(p.get('tag_on_success', ''))
         self.retry_on_empty.setChecked(p.get('retry_on_empty', False))
         self.verbose_logging.setChecked(p.get('verbose_logging', False))
+        self.dedupe_within_batch.setChecked(p.get('dedupe_within_batch', True))
+        self.cache_enabled.setChecked(p.get('cache_enabled', True))
+        self.cache_max_mb.setValue(p.get('cache_max_mb', 500))
+        self.empty_result_ttl.setValue(p.get('empty_result_ttl', 10))
         
-        stats = p.get('stats', {'requests': 0, 'input_tokens': 0, 'output_tokens': 0})
+        stats = p.get('stats') or {}
         self.stat_requests.setText(str(stats.get('requests', 0)))
         self.stat_input.setText(str(stats.get('input_tokens', 0)))
         self.stat_output.setText(str(stats.get('output_tokens', 0)))
@@ -499,14 +557,20 @@ class ConfigDialog(QDialog):
             self.add_config_item(cfg)
 
     def add_config_item(self, cfg):
-        status = "✅ " if cfg.get('enabled', True) else "❌ "
-        item_text = f"{status}{cfg['note_type']}: {cfg['source_field']} → {cfg['target_field']}"
-        item = QListWidgetItem(item_text)
-        if not cfg.get('enabled', True):
-            item.setForeground(Qt.GlobalColor.gray)
-        item.setData(0x0100, cfg)
+        item = QListWidgetItem()
+        self.set_config_item(item, cfg)
         self.note_configs.addItem(item)
 
+    def set_config_item(self, item, cfg):
+        enabled = cfg.get('enabled', True)
+        status = "✅ " if enabled else "❌ "
+        item.setText(f"{status}{cfg['note_type']}: {cfg['source_field']} → {cfg['target_field']}")
+        if enabled:
+            item.setData(Qt.ItemDataRole.ForegroundRole, None)
+        else:
+            item.setForeground(Qt.GlobalColor.gray)
+        item.setData(Qt.ItemDataRole.UserRole, cfg)
+
     def add_profile(self):
         name, ok = QInputDialog.getText(self, "New Profile", "Profile Name:")
         if ok and name:
@@ -517,7 +581,9 @@ class ConfigDialog(QDialog):
             new_profile = self.profiles[self.current_profile_name].copy()
             new_profile['stats'] = {'requests': 0, 'input_tokens': 0, 'output_tokens': 0}
             self.profiles[name] = new_profile
-            self.profile_combo.addItem(name)
+            self.profile_combo.blockSignals(True)
+            self._add_profile_item(name)
+            self.profile_combo.blockSignals(False)
             self.on_profile_change(name)
 
     def rename_profile(self):
@@ -530,48 +596,61 @@ class ConfigDialog(QDialog):
             self.profiles[new_name] = data
             self.current_profile_name = new_name
             self.profile_combo.blockSignals(True)
-            self.profile_combo.clear()
-            self.profile_combo.addItems(sorted(self.profiles.keys()))
+            self._remove_profile_item(current)
+            self._add_profile_item(new_name)
             self.profile_combo.setCurrentText(new_name)
             self.profile_combo.blockSignals(False)
 
     def delete_profile(self):
         if len(self.profiles) <= 1: return
         if askUser(f"Delete '{self.current_profile_name}'?"):
-            del self.profiles[self.current_profile_name]
-            new_name = sorted(self.profiles.keys())[0]
-            self.on_profile_change(new_name)
+            deleted = self.current_profile_name
+            del self.profiles[deleted]
             self.profile_combo.blockSignals(True)
-            self.profile_combo.clear()
-            self.profile_combo.addItems(sorted(self.profiles.keys()))
-            self.profile_combo.setCurrentText(new_name)
+            self._remove_profile_item(deleted)
             self.profile_combo.blockSignals(False)
+            self.on_profile_change(self._profile_names[0])
+
+    def _add_profile_item(self, name):
+        """Insert a profile name into the combo at its sorted position"""
+        row = bisect.bisect_left(self._profile_names, name)
+        self._profile_names.insert(row, name)
+        self.profile_combo.insertItem(row, name)
+
+    def _remove_profile_item(self, name):
+        row = bisect.bisect_left(self._profile_names, name)
+        del self._profile_names[row]
+        self.profile_combo.removeItem(row)
 
     # --- Note Config Helpers ---
+    def get_note_type_names(self):
+        if self._note_type_names is None:
+            self._note_type_names = [m.name for m in mw.col.models.all_names_and_ids()]
+        return self._note_type_names
+
+    def get_note_type_fields(self, name):
+        """Field names of a note type, or None if it doesn't exist"""
+        if name not in self._note_type_fields:
+            model = mw.col.models.by_name(name)
+            self._note_type_fields[name] = [f['name'] for f in model['flds']] if model else None
+        return self._note_type_fields[name]
+
     def add_note_config(self):
-        note_types = [m['name'] for m in mw.col.models.all()]
+        note_types = self.get_note_type_names()
         if not note_types: return
         note_type, ok = QInputDialog.getItem(self, "Select Note Type", "Type:", note_types, 0, False)
         if not ok: return
-        dialog = NoteTypeConfigDialog(self, note_type)
+        dialog = NoteTypeConfigDialog(self, note_type, fields=self.get_note_type_fields(note_type))
         if dialog.exec():
             self.add_config_item(dialog.get_config())
             
     def edit_note_config(self):
         current = self.note_configs.currentItem()
         if not current: return
-        cfg = current.data(0x0100)
-        dialog = NoteTypeConfigDialog(self, cfg['note_type'], cfg)
+        cfg = current.data(Qt.ItemDataRole.UserRole)
+        dialog = NoteTypeConfigDialog(self, cfg['note_type'], cfg, self.get_note_type_fields(cfg['note_type']))
         if dialog.exec():
-            new_cfg = dialog.get_config()
-            status = "✅ " if new_cfg.get('enabled', True) else "❌ "
-            item_text = f"{status}{new_cfg['note_type']}: {new_cfg['source_field']} → {new_cfg['target_field']}"
-            current.setText(item_text)
-            if not new_cfg.get('enabled', True):
-                current.setForeground(Qt.GlobalColor.gray)
-            else:
-                current.setForeground(Qt.GlobalColor.black)
-            current.setData(0x0100, new_cfg)
+            self.set_config_item(current, dialog.get_config())
             
     def remove_note_config(self):
         current = self.note_configs.currentItem()
@@ -1,17 +1,117 @@
+import re
 import struct
+import functools
 import time
-import mimetypes
 import json
+import threading
 import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
 from typing import Optional, Tuple, Dict, Callable
 
-# Use try-import for google-genai so it doesn't crash if only using ElevenLabs and lib is missing
-try:
-    from google import genai
-    from google.genai import types
-    HAS_GOOGLE = True
-except ImportError:
-    HAS_GOOGLE = False
+# google-genai is imported on first Gemini use: it is slow to import, not needed
+# for ElevenLabs, and may be missing entirely
+genai = None
+types = None
+
+def _import_genai() -> bool:
+    """Import google-genai if not done yet. Returns False if the library is missing."""
+    global genai, types, _API_ERRORS, _TIMEOUT_ERRORS, _GEMINI_LIMITS
+    if genai is None:
+        try:
+            import httpx
+            from google import genai as _genai
+            from google.genai import errors as _errors
+            from google.genai import types as _types
+        except ImportError:
+            return False
+        _API_ERRORS = (_errors.APIError,)
+        _TIMEOUT_ERRORS += (httpx.TimeoutException,)
+        _GEMINI_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+        genai, types = _genai, _types
+    return True
+
+# 44-byte PCM WAV header: RIFF chunk, fmt subchunk, data subchunk header
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+# Responses already in WAV form are used as-is; anything else is raw PCM
+_WAV_MIME_TYPES = frozenset({"audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave"})
+
+@functools.lru_cache(maxsize=32)
+def _parse_audio_mime_type(mime_type: str) -> Tuple[int, int]:
+    """(bits_per_sample, rate) from a mime type like "audio/L16;rate=24000".
+    Cached: a batch sees the same one or two mime types on every response."""
+    bits_per_sample = 16
+    rate = 24000
+
+    if not mime_type:
+        return bits_per_sample, rate
+
+    parts = mime_type.split(";")
+    for param in parts:
+        param = param.strip()
+        if param.lower().startswith("rate="):
+            try:
+                rate_str = param.split("=", 1)[1]
+                rate = int(rate_str)
+            except (ValueError, IndexError):
+                pass
+        elif param.startswith("audio/L"):
+            try:
+                bits_per_sample = int(param.split("L", 1)[1])
+            except (ValueError, IndexError):
+                pass
+
+    return bits_per_sample, rate
+
+# httpx drops idle connections after 5 s by default, less than a rate-limit backoff
+# or the gap between two batches; keep them long enough to be reused
+_GEMINI_LIMITS = None  # httpx.Limits, set once google-genai is imported
+
+# Gemini TTS models accept about 8k input tokens per request. Tokens are estimated
+# at four characters each (typical for English; most other scripts use fewer
+# characters per token), so the guard only catches text far beyond flashcard size.
+GEMINI_MAX_INPUT_TOKENS = 8192
+CHARS_PER_TOKEN = 4
+
+# Gemini clients by API key. Shared across processors so a new batch reuses the
+# previous batch's open connections instead of handshaking again.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def close_all_clients():
+    """Close and forget every shared Gemini client"""
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
+
+# Text that came back without audio (e.g. refused by the model) usually does so
+# again; re-runs within the processor's empty_result_ttl skip it instead of
+# paying for the request
+EMPTY_RESULT_MAX = 1024
+_empty_results = OrderedDict()  # (text, settings) -> monotonic time of the empty result
+_empty_results_lock = threading.Lock()
+
+def _recently_empty(key: Tuple, ttl: float) -> bool:
+    with _empty_results_lock:
+        stamp = _empty_results.get(key)
+        if stamp is None:
+            return False
+        if time.monotonic() - stamp < ttl:
+            return True
+        del _empty_results[key]
+        return False
+
+def _remember_empty(key: Tuple):
+    with _empty_results_lock:
+        _empty_results[key] = time.monotonic()
+        _empty_results.move_to_end(key)
+        while len(_empty_results) > EMPTY_RESULT_MAX:
+            _empty_results.popitem(last=False)
 
 class RateLimitError(Exception):
     pass
@@ -19,6 +119,38 @@ class RateLimitError(Exception):
 class EmptyResponseError(Exception):
     pass
 
+class QuotaExceededError(Exception):
+    """The account's quota is used up; retrying won't help until it resets"""
+    pass
+
+class InputTooLongError(Exception):
+    """The text is over the model's input limit and fails the same way every time"""
+    pass
+
+# Errors are classified by type where possible: google-genai's APIError carries
+# the HTTP status, and transport timeouts have their own classes. Only errors of
+# any other type fall back to a single scan of the message.
+_API_ERRORS = ()  # (google.genai.errors.APIError,) once google-genai is imported
+_TIMEOUT_ERRORS = (requests.exceptions.Timeout,)  # plus httpx's once imported
+_TRANSIENT_CODES = frozenset({500, 502, 503, 504})
+_RATE_LIMIT_RE = re.compile(r"429|resource_exhausted", re.I)
+_TRANSIENT_RE = re.compile(r"\b50[0234]\b|timeout|timed out", re.I)
+
+def _is_rate_limit_error(e: Exception) -> bool:
+    if isinstance(e, RateLimitError):
+        return True
+    if isinstance(e, _API_ERRORS):
+        return e.code == 429
+    return bool(_RATE_LIMIT_RE.search(str(e)))
+
+def _is_transient_error(e: Exception) -> bool:
+    if isinstance(e, _API_ERRORS):
+        return e.code in _TRANSIENT_CODES
+    # ElevenLabs failures are re-raised with the transport error as their cause
+    if isinstance(e, _TIMEOUT_ERRORS) or isinstance(e.__cause__, _TIMEOUT_ERRORS):
+        return True
+    return bool(_TRANSIENT_RE.search(str(e)))
+
 class TTSProcessor:
     """Handles TTS generation via Gemini API or ElevenLabs API"""
     
@@ -29,7 +161,9 @@ class TTSProcessor:
                  elevenlabs_voice_id: str = "",
                  elevenlabs_model: str = "eleven_turbo_v2_5",
                  elevenlabs_speed: float = 1.0,
-                 elevenlabs_language_code: str = ""):
+                 elevenlabs_language_code: str = "",
+                 max_connections: int = 1,
+                 empty_result_ttl: float = 600.0):
         
         self.service = service.lower()
         
@@ -40,6 +174,10 @@ class TTSProcessor:
         self.temperature = temperature
         self.system_instruction = system_instruction
         self.client = None
+        # Seconds to remember text that came back empty; 0 turns this off
+        self.empty_result_ttl = empty_result_ttl
+        self._generate_config = None
+        self._generate_config_key = None
         
         # ElevenLabs Config
         self.el_api_key = elevenlabs_api_key
@@ -48,10 +186,68 @@ class TTSProcessor:
         self.el_speed = elevenlabs_speed
         self.el_language_code = elevenlabs_language_code
         
+        # HTTP session shared by all ElevenLabs requests, so connections are kept alive
+        self.max_connections = max(1, max_connections)
+        self._session = None
+        self._session_lock = threading.Lock()
+        
     def initialize_client(self):
         """Initialize Gemini client if needed"""
-        if self.service == "gemini" and HAS_GOOGLE and not self.client and self.api_key:
-            self.client = genai.Client(api_key=self.api_key)
+        if self.service == "gemini" and not self.client and self.api_key and _import_genai():
+            with _clients_lock:
+                client = _clients.get(self.api_key)
+                if client is None:
+                    client = _clients[self.api_key] = genai.Client(
+                        api_key=self.api_key,
+                        http_options=types.HttpOptions(client_args={'limits': _GEMINI_LIMITS}),
+                    )
+            self.client = client
+
+    def _get_session(self) -> requests.Session:
+        """Return the shared HTTP session, sized for the number of concurrent requests"""
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def close(self):
+        """Release pooled HTTP connections"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _get_generate_config(self):
+        """The request config depends only on the voice settings, so it is built
+        once and reused until one of them changes"""
+        key = (self.voice_name, self.language_code, self.temperature)
+        if self._generate_config_key != key:
+            speech_config_kwargs = {
+                "voice_config": types.VoiceConfig(
+                    prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                        voice_name=self.voice_name
+                    )
+                )
+            }
+            if self.language_code:
+                speech_config_kwargs["language_code"] = self.language_code
+                
+            self._generate_config = types.GenerateContentConfig(
+                temperature=self.temperature,
+                response_modalities=["audio"],
+                speech_config=types.SpeechConfig(**speech_config_kwargs),
+            )
+            self._generate_config_key = key
+        return self._generate_config
+
+    def cache_signature(self, model: str) -> Tuple:
+        """Settings that affect the generated audio, used to key cached results"""
+        if self.service == 'elevenlabs':
+            return (self.service, self.el_voice_id, self.el_model, self.el_speed, self.el_language_code)
+        return (self.service, model, self.voice_name, self.language_code, self.temperature, self.system_instruction or '')
 
     def _generate_elevenlabs(self, text: str, check_cancel: Callable[[], bool]) -> Tuple[Optional[bytes], Dict]:
         """Internal method to handle ElevenLabs generation"""
@@ -88,25 +284,34 @@ class TTSProcessor:
         usage_stats = {'input_tokens': len(text), 'output_tokens': 0} 
 
         try:
-            response = requests.post(url, json=data, headers=headers, stream=True)
-            
-            if response.status_code == 429:
-                raise RateLimitError("ElevenLabs Rate Limit Hit")
-            
-            if response.status_code != 200:
-                try:
-                    err = response.json()
-                    msg = err.get('detail', {}).get('message', str(err))
-                except:
-                    msg = response.text
-                raise Exception(f"ElevenLabs Error {response.status_code}: {msg}")
-
-            audio_data = b""
-            for chunk in response.iter_content(chunk_size=1024):
-                if check_cancel and check_cancel():
-                    return None, usage_stats
-                if chunk:
-                    audio_data += chunk
+            # Context manager hands the connection back to the pool even on early return
+            with self._get_session().post(url, json=data, headers=headers, stream=True) as response:
+                if response.status_code == 429:
+                    raise RateLimitError("ElevenLabs Rate Limit Hit")
+                
+                if response.status_code != 200:
+                    status = None
+                    try:
+                        err = response.json()
+                        detail = err.get('detail', {})
+                        msg = detail.get('message', str(err))
+                        status = detail.get('status')
+                    except:
+                        msg = response.text
+                    # The quota state is only in detail.status; keep it in the message
+                    # so callers that see the error as text can still recognise it
+                    if status == 'quota_exceeded':
+                        raise QuotaExceededError(f"ElevenLabs Error {response.status_code} (quota_exceeded): {msg}")
+                    raise Exception(f"ElevenLabs Error {response.status_code}: {msg}")
+
+                # Appending to bytes would copy the whole buffer for every 1 KB chunk
+                audio_buf = bytearray()
+                for chunk in response.iter_content(chunk_size=1024):
+                    if check_cancel and check_cancel():
+                        return None, usage_stats
+                    if chunk:
+                        audio_buf += chunk
+                audio_data = bytes(audio_buf)
             
             if not audio_data:
                 raise EmptyResponseError("Empty audio received from ElevenLabs")
@@ -114,22 +319,25 @@ class TTSProcessor:
             return audio_data, usage_stats
 
         except Exception as e:
-            if isinstance(e, (RateLimitError, EmptyResponseError)):
+            if isinstance(e, (RateLimitError, EmptyResponseError, QuotaExceededError)):
                 raise e
-            raise Exception(f"ElevenLabs Request Failed: {str(e)}")
+            raise Exception(f"ElevenLabs Request Failed: {str(e)}") from e
+
+    def _gemini_prompt(self, text: str) -> str:
+        """The text as sent to Gemini, with the system instruction in front"""
+        if self.system_instruction and self.system_instruction.strip():
+            return f"{self.system_instruction.strip()}\n{text}"
+        return text
 
     def _generate_gemini(self, text: str, model: str, retry_on_empty: bool, check_cancel: Callable[[], bool]) -> Tuple[Optional[bytes], Dict]:
         """Internal method to handle Gemini generation"""
-        if not HAS_GOOGLE:
+        if not _import_genai():
             raise Exception("google-genai library not installed.")
         
         self.initialize_client()
         usage_stats = {'input_tokens': 0, 'output_tokens': 0}
         
-        final_text = text
-        if self.system_instruction and self.system_instruction.strip():
-            final_text = f"{self.system_instruction.strip()}\n{text}"
-
+        final_text = self._gemini_prompt(text)
         contents = [
             types.Content(
                 role="user",
@@ -137,56 +345,50 @@ class TTSProcessor:
             ),
         ]
         
-        speech_config_kwargs = {
-            "voice_config": types.VoiceConfig(
-                prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                    voice_name=self.voice_name
-                )
-            )
-        }
-        if self.language_code:
-            speech_config_kwargs["language_code"] = self.language_code
-            
-        generate_content_config = types.GenerateContentConfig(
-            temperature=self.temperature,
-            response_modalities=["audio"],
-            speech_config=types.SpeechConfig(**speech_config_kwargs),
-        )
+        generate_content_config = self._get_generate_config()
         
         audio_chunks = []
+        add_chunk = audio_chunks.append
         mime_type = None
         
         try:
-            for chunk in self.client.models.generate_content_stream(
+            stream = self.client.models.generate_content_stream(
                 model=model,
                 contents=contents,
                 config=generate_content_config,
-            ):
-                if check_cancel and check_cancel():
-                    return None, usage_stats
+            )
+            try:
+                for chunk in stream:
+                    if check_cancel and check_cancel():
+                        return None, usage_stats
 
-                if hasattr(chunk, 'usage_metadata') and chunk.usage_metadata:
-                    usage_stats['input_tokens'] = chunk.usage_metadata.prompt_token_count or 0
-                    usage_stats['output_tokens'] = chunk.usage_metadata.candidates_token_count or 0
+                    usage = chunk.usage_metadata
+                    if usage:
+                        usage_stats['input_tokens'] = usage.prompt_token_count or 0
+                        usage_stats['output_tokens'] = usage.candidates_token_count or 0
+
+                    candidates = chunk.candidates
+                    content = candidates[0].content if candidates else None
+                    if content and content.parts:
+                        inline = content.parts[0].inline_data
+                        if inline and inline.data:
+                            add_chunk(inline.data)
+                            if not mime_type:
+                                mime_type = inline.mime_type
+
+                    # The last candidate carries a finish reason; stop there rather
+                    # than waiting on the server to end the stream
+                    if candidates and candidates[0].finish_reason:
+                        break
+            finally:
+                # Ends the HTTP response so its connection goes back to the pool
+                stream.close()
 
-                if (chunk.candidates and 
-                    chunk.candidates[0].content and 
-                    chunk.candidates[0].content.parts):
-                    
-                    part = chunk.candidates[0].content.parts[0]
-                    
-                    if part.inline_data and part.inline_data.data:
-                        audio_chunks.append(part.inline_data.data)
-                        if not mime_type:
-                            mime_type = part.inline_data.mime_type
-                            
             if audio_chunks:
-                audio_data = b''.join(audio_chunks)
-                ext = mimetypes.guess_extension(mime_type) if mime_type else None
-                if ext is None or 'wav' not in str(ext).lower():
-                    final_audio = self.convert_to_wav(audio_data, mime_type or "audio/wav")
-                    return final_audio, usage_stats
-                return audio_data, usage_stats
+                base_mime = mime_type.split(";", 1)[0].strip().lower() if mime_type else ""
+                if base_mime not in _WAV_MIME_TYPES:
+                    return self._chunks_to_wav(audio_chunks, mime_type or "audio/wav"), usage_stats
+                return b''.join(audio_chunks), usage_stats
             
             if retry_on_empty:
                 raise EmptyResponseError("Received empty audio stream from API.")
@@ -194,26 +396,44 @@ class TTSProcessor:
             return None, usage_stats
 
         except Exception as e:
-            error_msg = str(e).lower()
-            if '429' in error_msg or 'resource_exhausted' in error_msg:
+            if not isinstance(e, RateLimitError) and _is_rate_limit_error(e):
                 raise RateLimitError(str(e))
             raise e
 
     def generate_audio(self, text: str, model: str, max_retries: int = 3, 
                       retry_delay: int = 2, retry_on_empty: bool = False,
-                      check_cancel: Callable[[], bool] = None) -> Tuple[Optional[bytes], Dict]:
+                      check_cancel: Callable[[], bool] = None,
+                      on_rate_limit: Callable[[], None] = None,
+                      before_attempt: Callable[[], bool] = None,
+                      cancel_event: threading.Event = None) -> Tuple[Optional[bytes], Dict]:
         """
         Generate audio and return data + usage stats.
         Routes to specific service based on config.
+        on_rate_limit is called for every rate-limited attempt, so callers can slow down.
+        before_attempt is called before every attempt, retries included; returning False stops.
+        cancel_event, when given, lets retry waits wake as soon as it is set.
         """
         usage_stats = {'input_tokens': 0, 'output_tokens': 0}
         
-        if not text or not text.strip():
+        # Whitespace is never worth a request, and is not sent along with the text
+        text = text.strip() if text else ''
+        if not text:
             return None, usage_stats
 
+        # A request over the input limit is rejected by the API anyway; refuse it
+        # before waiting for a pacing slot or spending a round trip on it
+        if self.service != 'elevenlabs':
+            estimated_tokens = len(self._gemini_prompt(text)) // CHARS_PER_TOKEN
+            if estimated_tokens > GEMINI_MAX_INPUT_TOKENS:
+                raise InputTooLongError(
+                    f"Text too long for one request (~{estimated_tokens} tokens, limit {GEMINI_MAX_INPUT_TOKENS})"
+                )
+
         for attempt in range(max_retries):
             if check_cancel and check_cancel():
                 return None, usage_stats
+            if before_attempt and not before_attempt():
+                return None, usage_stats
 
             try:
                 if self.service == 'elevenlabs':
@@ -226,25 +446,24 @@ class TTSProcessor:
                 if check_cancel and check_cancel():
                     return None, usage_stats
 
-                error_msg = str(e).lower()
-                is_rate_limit = isinstance(e, RateLimitError) or '429' in error_msg
+                # An exhausted quota fails the same way on every retry
+                if isinstance(e, QuotaExceededError):
+                    raise
+
+                is_rate_limit = _is_rate_limit_error(e)
+                if is_rate_limit and on_rate_limit:
+                    on_rate_limit()
                 
                 is_retryable = (
-                    '500' in error_msg or 
-                    '503' in error_msg or 
-                    'timeout' in error_msg or 
+                    is_rate_limit or
                     isinstance(e, EmptyResponseError) or
-                    is_rate_limit 
+                    _is_transient_error(e)
                 )
 
                 if is_retryable:
                     if attempt < max_retries - 1:
-                        # Interruptible sleep
-                        wait_sec = retry_delay * (attempt + 1)
-                        for _ in range(wait_sec * 10):
-                            if check_cancel and check_cancel():
-                                return None, usage_stats
-                            time.sleep(0.1)
+                        if self._sleep(retry_delay * (attempt + 1), check_cancel, cancel_event):
+                            return None, usage_stats
                         continue
                 
                 if is_rate_limit:
@@ -257,20 +476,44 @@ class TTSProcessor:
                 
         return None, usage_stats
         
+    def _sleep(self, seconds: float, check_cancel: Callable[[], bool],
+               cancel_event: threading.Event = None) -> bool:
+        """Sleep between retries; returns True if cancelled meanwhile.
+        Waits on cancel_event when given so a cancel wakes the sleep at once;
+        otherwise check_cancel is polled."""
+        if cancel_event is not None:
+            return cancel_event.wait(seconds)
+        deadline = time.monotonic() + seconds
+        while True:
+            if check_cancel and check_cancel():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(0.1, remaining))
+
     def convert_to_wav(self, audio_data: bytes, mime_type: str) -> bytes:
         """Convert raw audio data to WAV format if needed (Helper for Gemini)"""
-        parameters = self.parse_audio_mime_type(mime_type)
-        bits_per_sample = parameters["bits_per_sample"]
-        sample_rate = parameters["rate"]
+        return self._chunks_to_wav([audio_data], mime_type)
+
+    def _chunks_to_wav(self, chunks: list, mime_type: str) -> bytes:
+        """Build a WAV file from streamed PCM chunks. The header is sized up front
+        so header and samples are joined in a single copy."""
+        bits_per_sample, sample_rate = _parse_audio_mime_type(mime_type)
+        if bits_per_sample in (24, 32):
+            audio_data = self._downcast_to_16bit(b''.join(chunks), bits_per_sample // 8)
+            return self._wav_header(len(audio_data), 16, sample_rate) + audio_data
+        data_size = sum(map(len, chunks))
+        return b''.join([self._wav_header(data_size, bits_per_sample, sample_rate), *chunks])
+
+    def _wav_header(self, data_size: int, bits_per_sample: int, sample_rate: int) -> bytes:
         num_channels = 1
-        data_size = len(audio_data)
         bytes_per_sample = bits_per_sample // 8
         block_align = num_channels * bytes_per_sample
         byte_rate = sample_rate * block_align
         chunk_size = 36 + data_size
 
-        header = struct.pack(
-            "<4sI4s4sIHHIIHH4sI",
+        return _WAV_HEADER.pack(
             b"RIFF",
             chunk_size,
             b"WAVE",
@@ -285,37 +528,29 @@ class TTSProcessor:
             b"data",
             data_size
         )
-        return header + audio_data
         
-    def parse_audio_mime_type(self, mime_type: str) -> dict:
-        bits_per_sample = 16
-        rate = 24000
-
-        if not mime_type:
-            return {"bits_per_sample": bits_per_sample, "rate": rate}
-
-        parts = mime_type.split(";")
-        for param in parts:
-            param = param.strip()
-            if param.lower().startswith("rate="):
-                try:
-                    rate_str = param.split("=", 1)[1]
-                    rate = int(rate_str)
-                except (ValueError, IndexError):
-                    pass
-            elif param.startswith("audio/L"):
-                try:
-                    bits_per_sample = int(param.split("L", 1)[1])
-                except (ValueError, IndexError):
-                    pass
+    def _downcast_to_16bit(self, audio_data: bytes, sample_width: int) -> bytes:
+        """Keep the two most significant bytes of each little-endian sample.
+        Halves (32-bit) or shrinks by a third (24-bit) what gets written to the
+        media folder and synced; the lost precision is inaudible for speech."""
+        usable = len(audio_data) - len(audio_data) % sample_width
+        out = bytearray(usable // sample_width * 2)
+        out[0::2] = audio_data[sample_width - 2:usable:sample_width]
+        out[1::2] = audio_data[sample_width - 1:usable:sample_width]
+        return bytes(out)
 
+    def parse_audio_mime_type(self, mime_type: str) -> dict:
+        bits_per_sample, rate = _parse_audio_mime_type(mime_type)
         return {"bits_per_sample": bits_per_sample, "rate": rate}
         
     def generate_with_fallback(self, text: str, primary_model: str, 
                                fallback_model: str, enable_fallback: bool,
                                max_retries: int = 3, retry_delay: int = 2,
                                retry_on_empty: bool = False,
-                               check_cancel: Callable[[], bool] = None) -> Tuple[Optional[bytes], str, Dict]:
+                               check_cancel: Callable[[], bool] = None,
+                               on_rate_limit: Callable[[], None] = None,
+                               before_attempt: Callable[[], bool] = None,
+                               cancel_event: threading.Event = None) -> Tuple[Optional[bytes], str, Dict]:
         """
         Generate audio with automatic fallback. Returns (audio, model_name, usage_stats)
         """
@@ -324,20 +559,27 @@ class TTSProcessor:
         if self.service == 'elevenlabs':
             reported_model = self.el_model
 
+        remember_empty = self.empty_result_ttl > 0
+        empty_key = (text, retry_on_empty, self.cache_signature(primary_model))
+        if remember_empty and _recently_empty(empty_key, self.empty_result_ttl):
+            return None, "No audio generated (also empty on an earlier try this session)", {}
+
         try:
             # Primary attempt
-            audio, stats = self.generate_audio(text, primary_model, max_retries, retry_delay, retry_on_empty, check_cancel)
+            audio, stats = self.generate_audio(text, primary_model, max_retries, retry_delay, retry_on_empty, check_cancel, on_rate_limit, before_attempt, cancel_event)
             if audio:
                 return audio, reported_model, stats
+            if remember_empty and not (check_cancel and check_cancel()):
+                _remember_empty(empty_key)
             return None, "No audio generated", stats
             
         except RateLimitError as e:
             if enable_fallback and self.service == 'gemini':
                 try:
-                    if check_cancel and not check_cancel():
-                        time.sleep(1)
+                    if self._sleep(1, check_cancel, cancel_event):
+                        return None, "Cancelled", {}
                     
-                    audio, stats = self.generate_audio(text, fallback_model, max_retries, retry_delay, retry_on_empty, check_cancel)
+                    audio, stats = self.generate_audio(text, fallback_model, max_retries, retry_delay, retry_on_empty, check_cancel, on_rate_limit, before_attempt, cancel_event)
                     if audio:
                         return audio, fallback_model, stats
                     return None, "Fallback model: No audio generated", stats